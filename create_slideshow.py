@@ -1,20 +1,18 @@
 import argparse
-from slideshow_optimization import (
-    utils,
-    plot_utils,
-    arrange_photos,
-    post_processing,
-    match_vertical_photos,
-)
+from slideshow_optimization import utils, plot_utils, compress_tags, create_slideshow
+from slideshow_optimization.pipeline import OPTIMIZERS
 
 
-def _create_slideshow(path: str, out: str = "submission.txt", plot: bool = False):
-    data = utils.read_file(path)
+def _create_slideshow(
+    path: str,
+    out: str = "submission.txt",
+    plot: bool = False,
+    optimizer: str = "2opt",
+    time_limit: float = 60,
+):
+    data = compress_tags(utils.read_file(path))
 
-    slideshow, vertical_photos = arrange_photos(data)
-    combine_photos = match_vertical_photos(vertical_photos)
-    slideshow, _ = arrange_photos(slideshow + combine_photos)
-    slideshow = post_processing(slideshow)
+    slideshow, _ = create_slideshow(data, optimizer=optimizer, time_limit=time_limit)
 
     score = utils.sequence_score(slideshow)
     max_score = utils.sequence_max_score(slideshow)
@@ -31,7 +29,15 @@ if __name__ == "__main__":
     parser.add_argument("path", help="path to input data")
     parser.add_argument("--out", default="submission.txt", help="path to output")
     parser.add_argument("--plot", action="store_true", help="display graphics")
+    parser.add_argument(
+        "--optimizer", default="2opt", choices=OPTIMIZERS, help="post processing engine"
+    )
+    parser.add_argument(
+        "--time-limit", type=float, default=60, help="time budget of lk optimizer"
+    )
     flags = parser.parse_args()
     print(flags)
 
-    _create_slideshow(flags.path, flags.out, flags.plot)
+    _create_slideshow(
+        flags.path, flags.out, flags.plot, flags.optimizer, flags.time_limit
+    )
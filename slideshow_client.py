@@ -0,0 +1,74 @@
+import os
+import sys
+import asyncio
+import argparse
+from slideshow_optimization.client import submit
+from slideshow_optimization.server import SOCKET
+from slideshow_optimization.pipeline import OPTIMIZERS
+
+
+def _printer(path: str):
+    name = os.path.basename(path)
+
+    def callback(event):
+        kind = event["event"]
+        if kind == "progress":
+            message = (
+                f"{event['stage']}: Score = {event['score']} / {event['max_score']}"
+            )
+        elif kind == "queued":
+            message = f"queued as job {event['job']}, position {event['position']}"
+        elif kind == "started":
+            cached = ", cached input" if event["cached"] else ""
+            message = f"started on worker {event['pid']}{cached}"
+        elif kind in ("done", "timeout"):
+            message = (
+                f"Score = {event['score']} / {event['max_score']}"
+                f" in {event['elapsed']:.1f}s, saved to {event['out']}"
+            )
+            if kind == "timeout":
+                message = "time limit is reached, partial result: " + message
+        else:
+            message = f"{kind}: {event.get('message', '')}"
+        print(f"[{name}] {message}")
+
+    return callback
+
+
+async def _main(flags):
+    jobs = [
+        submit(
+            os.path.abspath(path),
+            out=os.path.abspath(flags.out) if flags.out else None,
+            priority=flags.priority,
+            time_limit=flags.time_limit,
+            optimizer=flags.optimizer,
+            socket_path=flags.socket,
+            port=flags.port,
+            callback=_printer(path),
+        )
+        for path in flags.paths
+    ]
+    results = await asyncio.gather(*jobs)
+    return all(x["event"] == "done" for x in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="paths to input data")
+    parser.add_argument("--out", help="path to output (only with a single input)")
+    parser.add_argument(
+        "--priority", type=int, default=0, help="jobs with lower value run first"
+    )
+    parser.add_argument("--time-limit", type=float, help="time budget of each job")
+    parser.add_argument(
+        "--optimizer", default="2opt", choices=OPTIMIZERS, help="post processing engine"
+    )
+    parser.add_argument("--socket", default=SOCKET, help="path to server unix socket")
+    parser.add_argument("--port", type=int, help="connect to localhost:port instead")
+    flags = parser.parse_args()
+
+    if flags.out and len(flags.paths) > 1:
+        parser.error("--out can be used only with a single input")
+
+    sys.exit(0 if asyncio.run(_main(flags)) else 1)
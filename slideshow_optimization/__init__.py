@@ -1,3 +1,6 @@
 from .arrange_photos import arrange_photos
+from .lk_optimization import lk_optimization
+from .pipeline import create_slideshow
 from .post_processing import post_processing
+from .preprocessing import compress_tags
 from .match_vertical_photos import match_vertical_photos
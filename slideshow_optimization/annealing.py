@@ -0,0 +1,250 @@
+import math
+import time
+import random
+import numpy as np
+from typing import List
+from multiprocessing import Pool
+from .utils import popcount, to_int_bits
+from .models import Photo
+from .similarity_graph import SimilarityGraph
+
+# chains with fewer moves in total run in the calling process
+MIN_PARALLEL_MOVES = 100000
+
+_POOLS = {}
+
+
+class Chain:
+    """
+    Simulated annealing over a set of subsequences of one bucket.
+    Energy = number of subsequences + lost_weight * lost score,
+    where lost score of an edge is th - score.
+    """
+
+    def __init__(self, bits, sizes, candidates, sequences, th, lost_weight, seed):
+        self.bits = bits
+        self.sizes = sizes
+        self.candidates = candidates
+        self.th = th
+        self.lost_weight = lost_weight
+        self.random = random.Random(seed)
+
+        n = len(bits)
+        self.sequences = {}
+        self.where = [0] * n
+        self.pos = [0] * n
+        for sid, sequence in enumerate(sequences):
+            self._set(sid, sequence)
+        self.next_sid = len(sequences)
+
+        losses = [
+            self.loss(s[i - 1], s[i]) for s in sequences for i in range(1, len(s))
+        ]
+        self.count = len(sequences)
+        self.lost = sum(losses)
+        self.nb_lossy = sum(x > 0 for x in losses)
+
+    def loss(self, a, b) -> int:
+        overlap = popcount(self.bits[a] & self.bits[b])
+        return self.th - min(overlap, self.sizes[a] - overlap, self.sizes[b] - overlap)
+
+    def _set(self, sid, sequence):
+        self.sequences[sid] = sequence
+        for i, x in enumerate(sequence):
+            self.where[x] = sid
+            self.pos[x] = i
+
+    def _new(self, sequence):
+        self._set(self.next_sid, sequence)
+        self.next_sid += 1
+
+    def perfect_sequences(self):
+        """ current sequences split at all lossy edges """
+        out = []
+        for sequence in self.sequences.values():
+            start = 0
+            for i in range(1, len(sequence)):
+                if self.loss(sequence[i - 1], sequence[i]) > 0:
+                    out.append(sequence[start:i])
+                    start = i
+            out.append(sequence[start:])
+        return out
+
+    def propose(self, p_split=0.1):
+        """
+        Random move as (delta count, losses of added edges, losses of removed edges,
+        apply function), None if the move is not possible
+        """
+        rnd = self.random
+        node = rnd.randrange(len(self.bits))
+        sid = self.where[node]
+        s1 = self.sequences[sid]
+
+        if rnd.random() < p_split:
+            i = self.pos[node]
+            if i + 1 >= len(s1):
+                return None
+
+            def split():
+                self._set(sid, s1[: i + 1])
+                self._new(s1[i + 1 :])
+
+            return 1, [], [self.loss(s1[i], s1[i + 1])], split
+
+        # orient sequence 1 so that a is its last photo
+        if rnd.random() < 0.5:
+            s1 = s1[::-1]
+        a = s1[-1]
+        if not self.candidates[a]:
+            return None
+        c = rnd.choice(self.candidates[a])
+        cid = self.where[c]
+        s2 = self.sequences[cid]
+
+        if cid == sid:
+            # partial reverse: ..., c, x, ..., a -> ..., c, a, ..., x
+            t = s1.index(c)
+            if t + 2 >= len(s1):
+                return None
+
+            def reverse():
+                self._set(sid, s1[: t + 1] + s1[t + 1 :][::-1])
+
+            return 0, [self.loss(c, a)], [self.loss(c, s1[t + 1])], reverse
+
+        t = self.pos[c]
+        if t == 0 or t == len(s2) - 1:
+            # join: ..., a + c, ...
+            s2 = s2 if t == 0 else s2[::-1]
+
+            def join():
+                del self.sequences[sid]
+                self._set(cid, s1 + s2)
+
+            return -1, [self.loss(a, c)], [], join
+
+        # cut sequence 2 between c and its neighbour nb
+        if rnd.random() < 0.5:
+            s2 = s2[::-1]
+            t = len(s2) - 1 - t
+        nb, b = s2[t + 1], s1[0]
+
+        if rnd.random() < 0.5:
+            # insert: ..., c, a, ..., b, nb, ...
+            added, removed = [self.loss(c, a), self.loss(b, nb)], [self.loss(c, nb)]
+
+            def insert():
+                del self.sequences[sid]
+                self._set(cid, s2[: t + 1] + s1[::-1] + s2[t + 1 :])
+
+            return -1, added, removed, insert
+
+        # shuffle: ..., c, a, ..., b and nb, ...
+        added, removed = [self.loss(c, a)], [self.loss(c, nb)]
+
+        def shuffle():
+            self._set(cid, s2[: t + 1] + s1[::-1])
+            self._set(sid, s2[t + 1 :])
+
+        return 0, added, removed, shuffle
+
+    def run(self, nb_moves, deadline=None, t_start=1.0, t_end=0.05):
+        """
+        Anneal for nb_moves proposed moves (or until time.time() reaches deadline),
+        return the best state split into perfect subsequences
+        """
+        best_count = self.count + self.nb_lossy
+        best = self.perfect_sequences()
+
+        for step in range(0, nb_moves, 100):
+            if self.count == 1:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+            temperature = t_start * (t_end / t_start) ** (step / nb_moves)
+
+            for _ in range(100):
+                move = self.propose()
+                if move is None:
+                    continue
+
+                d_count, added, removed, apply = move
+                d_lost = sum(added) - sum(removed)
+                delta = d_count + self.lost_weight * d_lost
+                if delta <= 0 or self.random.random() < math.exp(-delta / temperature):
+                    apply()
+                    self.count += d_count
+                    self.lost += d_lost
+                    self.nb_lossy += sum(x > 0 for x in added)
+                    self.nb_lossy -= sum(x > 0 for x in removed)
+
+                    if self.count + self.nb_lossy < best_count:
+                        best_count = self.count + self.nb_lossy
+                        best = self.perfect_sequences()
+
+        return best
+
+
+def _run_chain(args):
+    return Chain(*args[:-2]).run(*args[-2:])
+
+
+def _pool(nb_processes: int):
+    """ worker pool shared by all anneal calls of the process """
+    if nb_processes not in _POOLS:
+        _POOLS[nb_processes] = Pool(nb_processes)
+    return _POOLS[nb_processes]
+
+
+def anneal(
+    sequences: List[List[Photo]],
+    graph: SimilarityGraph,
+    th=1,
+    nb_moves=1000,
+    nb_chains=4,
+    lost_weight=3.0,
+    k=16,
+    deadline=None,
+):
+    """
+    Try to reduce number of perfect subsequences with simulated annealing,
+    nb_chains independent chains are run in worker processes
+    (in this process if there are few moves), the best final state is returned
+    nb_moves -- number of proposed moves per chain
+    deadline -- time.time() at which the chains are stopped
+    """
+    if len(sequences) <= 1 or th == 0 or nb_moves <= 0:
+        return sequences
+
+    if deadline is not None and time.time() >= deadline:
+        return sequences
+
+    photos = [x for s in sequences for x in s]
+    index = {x.id: i for i, x in enumerate(photos)}
+    bits = to_int_bits(photos)
+    sizes = [len(x) for x in photos]
+    candidates = [
+        [
+            index[y.id]
+            for y, s, _ in graph.neighbours(x)
+            if s >= th - 1 and y.id in index
+        ][:k]
+        for x in photos
+    ]
+    initial = [[index[x.id] for x in s] for s in sequences]
+
+    seeds = np.random.randint(2 ** 31, size=nb_chains).tolist()
+    tasks = [
+        (bits, sizes, candidates, initial, th, lost_weight, seed, nb_moves, deadline)
+        for seed in seeds
+    ]
+    if nb_chains == 1 or nb_moves * nb_chains < MIN_PARALLEL_MOVES:
+        results = [_run_chain(x) for x in tasks]
+    else:
+        results = _pool(nb_chains).map(_run_chain, tasks)
+
+    best = min(results, key=len)
+    if len(best) >= len(sequences):
+        return sequences
+
+    return [[photos[x] for x in s] for s in best]
@@ -1,28 +1,44 @@
+import time
 import itertools
 import numpy as np
 from tqdm import tqdm
 from typing import List
 from .utils import (
-    to_array,
-    calc_score,
-    array_score,
+    to_bits,
+    nb_tags,
+    bits_score,
     sequence_score,
     lazy_calc_score,
     sequence_max_score,
     sequence_lost_score,
 )
 from .models import Photo, Orientation
-
-ALL_TAGS = []
-
-
-def arrange_photos(data: List[Photo]):
-    global ALL_TAGS
-    ALL_TAGS = sorted(set([x for x in map(lambda x: x.tags, data) for x in x]))
-
+from .annealing import anneal
+from .preprocessing import check_compressed
+from .proposals import ProposalBuffer
+from .similarity_graph import SimilarityGraph, build_similarity_graph
+
+
+def arrange_photos(
+    data: List[Photo],
+    annealing_moves=100,
+    nb_chains=4,
+    max_attempts=50,
+    deadline=None,
+):
+    """
+    annealing_moves -- number of annealing moves per subsequence and chain
+    nb_chains -- number of annealing chains per bucket
+    max_attempts -- number of stitching rounds without improvement before stopping
+    deadline -- time.time() after which subsequences are no longer improved
+    """
+    check_compressed(data)
     photos = [x for x in data if x.orientation != Orientation.Vertical]
     vertical_photos = [x for x in data if x.orientation == Orientation.Vertical]
 
+    graph = build_similarity_graph(photos, by_size=True)
+    tags_range = nb_tags(data)
+
     print("Arranging photos...")
 
     np.random.seed(12)
@@ -34,24 +50,37 @@ def arrange_photos(data: List[Photo]):
         if not sequence:
             continue
 
-        sequences = _create_sub_sequences(sequence, th=slide_score)
+        sequences = _create_sub_sequences(sequence, graph, th=slide_score)
+        proposals = _create_proposals(
+            vertical_photos, tags_range, th=slide_score, size=20000
+        )
 
         nb_attempts = 0
         previous_total_score = 0
         bar = tqdm(total=len(sequences) - 1, desc=f"Processing {sizes}")
+
+        nb_sequence = len(sequences)
+        sequences = anneal(
+            sequences,
+            graph,
+            th=slide_score,
+            nb_moves=annealing_moves * len(sequences),
+            nb_chains=nb_chains,
+            deadline=deadline,
+        )
+        bar.update(nb_sequence - len(sequences))
+
         while True:
             # subsequence post processing
             # trying to reduce number of subsequences, all subsequences must remain perfect
             nb_sequence = len(sequences)
-            sequences = _stitch(sequences, th=slide_score)
-            sequences = _insert(sequences, th=slide_score)
-            sequences = _shuffle(sequences, th=slide_score, p=0.1)
-            sequences = _partial_reverse(sequences, th=slide_score, p=0.1)
+            sequences = _stitch(sequences, graph, th=slide_score)
+            sequences = _insert(sequences, graph, th=slide_score)
             sequences, vertical_photos = _stitch_by_vertical_photos(
                 sequences,
                 vertical_photos,
+                proposals,
                 th=slide_score,
-                nb_proposals=20000,
                 p_build=0.02,
             )
 
@@ -64,7 +93,10 @@ def arrange_photos(data: List[Photo]):
                 nb_attempts = 0
             previous_total_score = total_score
 
-            if len(sequences) == 1 or nb_attempts >= 50:
+            if len(sequences) == 1 or nb_attempts >= max_attempts:
+                break
+
+            if deadline is not None and time.time() >= deadline:
                 break
 
         bar.close()
@@ -82,7 +114,18 @@ def arrange_photos(data: List[Photo]):
     return arranged_photos, vertical_photos
 
 
-def _stitch(sequences, th=1):
+def _locate(sequences):
+    """ map photo id to (sequence index, position in the sequence) """
+    return {p.id: (j, t) for j, s in enumerate(sequences) for t, p in enumerate(s)}
+
+
+def _relocate(located, sequences, *indexes):
+    for j in indexes:
+        for t, p in enumerate(sequences[j]):
+            located[p.id] = (j, t)
+
+
+def _stitch(sequences, graph: SimilarityGraph, th=1):
     """ trying to connect two different sequences """
     if len(sequences) <= 1:
         return sequences
@@ -90,143 +133,97 @@ def _stitch(sequences, th=1):
     if th == 0:
         return [sum(sequences, [])]
 
-    for i, j in itertools.combinations(range(len(sequences)), r=2):
-        s1, s2 = sequences[i], sequences[j]
-
-        if not s1 or not s2:
-            continue
+    # the first and the last photos of the sequences
+    ends, located = {}, {}
+    for j, s in enumerate(sequences):
+        for p in (s[0], s[-1]):
+            ends[p.id], located[p.id] = p, j
 
-        if lazy_calc_score(s1[-1], s2[0]) >= th:
-            sequences[i], sequences[j] = [], s1 + s2
-            continue
+    for i in range(len(sequences)):
+        for s1 in (sequences[i], sequences[i][::-1]):
+            if not s1:
+                break
 
-        if lazy_calc_score(s1[-1], s2[-1]) >= th:
-            sequences[i], sequences[j] = [], s1 + s2[::-1]
-            continue
+            p2 = next(
+                (x for x in graph.candidates(s1[-1], th, ends) if located[x.id] != i),
+                None,
+            )
+            if p2 is None:
+                continue
 
-        if lazy_calc_score(s1[0], s2[0]) >= th:
-            sequences[i], sequences[j] = [], s1[::-1] + s2
-            continue
+            j = located[p2.id]
+            s2 = sequences[j] if sequences[j][0].id == p2.id else sequences[j][::-1]
+            sequences[i], sequences[j] = [], s1 + s2
 
-        if lazy_calc_score(s1[0], s2[-1]) >= th:
-            sequences[i], sequences[j] = [], s1[::-1] + s2[::-1]
-            continue
+            for p in (s1[0], s1[-1], s2[0], s2[-1]):
+                ends.pop(p.id, None)
+            for p in (s1[0], s2[-1]):
+                ends[p.id], located[p.id] = p, j
+            break
 
     return [s for s in sequences if s]
 
 
-def _do_insert(s1, s2, th):
-    """ trying to insert sequence 1 into sequence 2 """
-    if not s1 or len(s2) <= 1:
-        return False, None
-
-    for i, p2 in enumerate(s2[1:], start=1):
-        p1 = s2[i - 1]
-
-        if lazy_calc_score(p1, s1[0]) >= th and lazy_calc_score(s1[-1], p2) >= th:
-            return True, s2[:i] + s1 + s2[i:]
-
-        if lazy_calc_score(p1, s1[-1]) >= th and lazy_calc_score(s1[0], p2) >= th:
-            return True, s2[:i] + s1[::-1] + s2[i:]
-
-    return False, None
-
-
-def _insert(sequences, th):
-    if len(sequences) <= 1:
-        return sequences
-
-    for i, j in itertools.product(range(len(sequences)), repeat=2):
-        if i != j:
-            status, combined_sequence = _do_insert(sequences[i], sequences[j], th=th)
-            if status:
-                sequences[i], sequences[j] = [], combined_sequence
-
-    return [s for s in sequences if s]
+def _do_insert(i, sequences, graph, photos, located, th):
+    """ trying to insert sequence i into another sequence """
+    s1 = sequences[i]
+    if not s1:
+        return None, None
 
+    for s1 in (s1, s1[::-1]):
+        for p1 in graph.candidates(s1[0], th, photos):
+            j, t = located[p1.id]
+            s2 = sequences[j]
+            if j == i or t + 1 >= len(s2):
+                continue
 
-def _do_partial_reverse(sequence, th=1, p=0.1):
-    """ trying to reverse part of the sequence """
-    if len(sequence) <= 2 or p == 0:
-        return sequence
+            if lazy_calc_score(s1[-1], s2[t + 1]) >= th:
+                return j, s2[: t + 1] + s1 + s2[t + 1 :]
 
-    first_photo = sequence[0]
-    for i, photo in enumerate(sequence[2:], start=2):
-        if calc_score(first_photo, photo) >= th:
-            if np.random.random_sample() < p:
-                return sequence[:i][::-1] + sequence[i:]
+    return None, None
 
-    return sequence
 
-
-def _partial_reverse(sequences, th=1, p=0.1):
+def _insert(sequences, graph: SimilarityGraph, th):
     if len(sequences) <= 1:
         return sequences
 
+    photos = {p.id: p for s in sequences for p in s}
+    located = _locate(sequences)
     for i in range(len(sequences)):
-        sequences[i] = _do_partial_reverse(sequences[i], th=th, p=p)
-        sequences[i] = _do_partial_reverse(sequences[i][::-1], th=th, p=p)
-
-    return sequences
-
-
-def _do_shuffle(s1, s2, th=1, p=0.1):
-    """ trying to swap some subsequence from sequence 1 and sequence 2 """
-    if not s1 or len(s2) <= 1 or p == 0:
-        return s1, s2
-
-    for i, p2 in enumerate(s2[1:], start=1):
-        p1 = s2[i - 1]
-
-        if lazy_calc_score(p1, s1[0]) >= th:
-            if np.random.random_sample() < p:
-                return s2[:i] + s1, s2[i:]
-
-        if lazy_calc_score(p1, s1[-1]) >= th:
-            if np.random.random_sample() < p:
-                return s2[:i] + s1[::-1], s2[i:]
-
-    return s1, s2
-
-
-def _shuffle(sequences, th=1, p=0.1):
-    if len(sequences) <= 1 or p == 0:
-        return sequences
-
-    for i, j in itertools.product(range(len(sequences)), repeat=2):
-        if i != j:
-            sequences[i], sequences[j] = _do_shuffle(
-                sequences[i], sequences[j], th=th, p=p
-            )
+        j, combined_sequence = _do_insert(i, sequences, graph, photos, located, th)
+        if j is not None:
+            sequences[i], sequences[j] = [], combined_sequence
+            _relocate(located, sequences, j)
 
     return [s for s in sequences if s]
 
 
-def _create_sub_sequences(sequence, th=1):
+def _create_sub_sequences(sequence, graph: SimilarityGraph, th=1):
     """ create list of perfect subsequence """
     out = []
     if not sequence:
         return out
 
-    sub_sequence = [sequence[0]]
-    sequence = sequence[1:]
-    while sequence:
+    remaining = {x.id: x for x in sequence}
+    sub_sequence = [remaining.pop(sequence[0].id)]
+    while remaining:
         p1 = sub_sequence[-1]
 
         _next = None
-        for i, p2 in enumerate(sequence):
-            if p2 & p1 == th:
-                _next = i
+        for p2, _, overlap in graph.neighbours(p1):
+            if overlap == th and p2.id in remaining:
+                _next = p2.id
                 break
 
+        if _next is None and not graph.is_complete(p1, th):
+            # all neighbours are used, but the list was truncated
+            _next = next((x.id for x in remaining.values() if x & p1 == th), None)
+
         if _next is not None:
-            p2 = sequence[_next]
-            sub_sequence.append(p2)
-            sequence.pop(_next)
+            sub_sequence.append(remaining.pop(_next))
         else:
             out.append(sub_sequence)
-            sub_sequence = [sequence[0]]
-            sequence = sequence[1:]
+            sub_sequence = [remaining.pop(next(iter(remaining)))]
 
     out.append(sub_sequence)
 
@@ -235,21 +232,33 @@ def _create_sub_sequences(sequence, th=1):
     return out
 
 
-def _do_stitch_by_vertical_photos(sequences, proposals, th=1, p_build=0.05):
-    if len(sequences) <= 1 or len(proposals) < 1:
+def _do_stitch_by_vertical_photos(
+    sequences, proposals: ProposalBuffer, th=1, p_build=0.05
+):
+    if len(sequences) <= 1:
+        return
+
+    proposals.fill()
+    keys = np.where(proposals.valid)[0]
+    if len(keys) < 1:
         return
 
-    proposals = np.array(proposals)
-    ar = to_array(proposals, ALL_TAGS)
-    used_pairs = set()
+    ar, ar_sizes = proposals.pair_bits[keys], proposals.pair_sizes[keys]
+    nb_bits = ar.shape[1] * 64
+    scores = {}
 
-    def update(_i, _j, _pair, _new_sequence):
+    def score(_photo):
+        # scores of a photo with all remaining proposals
+        if _photo.id not in scores:
+            v = to_bits(_photo, nb_bits)
+            scores[_photo.id] = bits_score(v, len(_photo), ar, ar_sizes)
+        return scores[_photo.id]
+
+    def update(_i, _j, _new_sequence):
         sequences[_i], sequences[_j] = [], _new_sequence
-        used_pairs.update([x for x in _pair.id])
 
-    def build(_i, _pair, _new_sequence):
+    def build(_i, _new_sequence):
         sequences[_i] = _new_sequence
-        used_pairs.update([x for x in _pair.id])
 
     pair = None
     for i, j in itertools.combinations(range(len(sequences)), r=2):
@@ -258,120 +267,98 @@ def _do_stitch_by_vertical_photos(sequences, proposals, th=1, p_build=0.05):
             continue
 
         if pair is not None:
-            cond = [
-                p.id[0] not in pair.id and p.id[1] not in pair.id for p in proposals
-            ]
-            proposals = proposals[cond]
-            ar = ar[cond]
+            cond = proposals.valid[keys]
+            keys, ar, ar_sizes = keys[cond], ar[cond], ar_sizes[cond]
+            scores = {k: x[cond] for k, x in scores.items()}
 
-        s11 = array_score(to_array(s1[0], ALL_TAGS), ar)
-        s12 = s11 if len(s1) == 1 else array_score(to_array(s1[-1], ALL_TAGS), ar)
-        s21 = array_score(to_array(s2[0], ALL_TAGS), ar)
-        s22 = s21 if len(s2) == 1 else array_score(to_array(s2[-1], ALL_TAGS), ar)
+        s11, s12 = score(s1[0]), score(s1[-1])
+        s21, s22 = score(s2[0]), score(s2[-1])
 
         cond = s12 + s21 >= th * 2
         if np.any(cond):
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            update(i, j, pair, s1 + [pair] + s2)
+            pair = proposals.consume(keys[i_pair])
+            update(i, j, s1 + [pair] + s2)
             continue
 
         cond = s12 + s22 >= th * 2
         if np.any(cond):
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            update(i, j, pair, s1 + [pair] + s2[::-1])
+            pair = proposals.consume(keys[i_pair])
+            update(i, j, s1 + [pair] + s2[::-1])
             continue
 
         cond = s11 + s21 >= th * 2
         if np.any(cond):
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            update(i, j, pair, s1[::-1] + [pair] + s2)
+            pair = proposals.consume(keys[i_pair])
+            update(i, j, s1[::-1] + [pair] + s2)
             continue
 
         cond = s11 + s22 >= th * 2
         if np.any(cond):
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            update(i, j, pair, s1[::-1] + [pair] + s2[::-1])
+            pair = proposals.consume(keys[i_pair])
+            update(i, j, s1[::-1] + [pair] + s2[::-1])
             continue
 
         cond = s11 >= th
         if np.any(cond) and np.random.random_sample() <= p_build:
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            build(i, pair, [pair] + s1)
+            pair = proposals.consume(keys[i_pair])
+            build(i, [pair] + s1)
             continue
 
         cond = s12 >= th
         if np.any(cond) and np.random.random_sample() <= p_build:
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            build(i, pair, s1 + [pair])
+            pair = proposals.consume(keys[i_pair])
+            build(i, s1 + [pair])
             continue
 
         cond = s21 >= th
         if np.any(cond) and np.random.random_sample() <= p_build:
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            build(j, pair, [pair] + s2)
+            pair = proposals.consume(keys[i_pair])
+            build(j, [pair] + s2)
             continue
 
         cond = s22 >= th
         if np.any(cond) and np.random.random_sample() <= p_build:
             i_pair = np.random.choice(np.where(cond)[0])
-            pair = proposals[i_pair]
-            build(j, pair, s2 + [pair])
+            pair = proposals.consume(keys[i_pair])
+            build(j, s2 + [pair])
             continue
 
         pair = None
 
-    return used_pairs
-
-
-def _stitch_by_vertical_photos(
-    sequences, vertical_photos, th=1, nb_proposals=10000, p_build=0.05
-):
-    if len(sequences) <= 1 or not any(len(x) <= th for x in vertical_photos):
-        return sequences, vertical_photos
 
-    pair_sizes = [(x, th * 2 - x) for x in range(1, th + 1)]
-    for s1, s2 in pair_sizes:
-        p1 = [i for i, p in enumerate(vertical_photos) if len(p) == s1]
-        p2 = [i for i, p in enumerate(vertical_photos) if len(p) == s2]
+def _create_proposals(vertical_photos, nb_tags, th=1, size=10000):
+    """ proposal buffers for all pairs of sizes which give a slide with 2 * th tags """
+    proposals = []
+    for s1, s2 in [(x, th * 2 - x) for x in range(1, th + 1)]:
+        p1 = [p for p in vertical_photos if len(p) == s1]
+        p2 = p1 if s1 == s2 else [p for p in vertical_photos if len(p) == s2]
         if not p1 or not p2:
             continue
 
-        np.random.shuffle(p1)
-        np.random.shuffle(p2)
+        proposals.append(ProposalBuffer(p1, p2, nb_tags, size))
 
-        pairs = []
-        if s1 != s2:
-            for i1, i2 in itertools.product(p1, p2):
-                p1, p2 = vertical_photos[i1], vertical_photos[i2]
-                if p1 & p2 > 0:
-                    continue
+    return proposals
 
-                pairs.append(p1 | p2)
-                if len(pairs) >= nb_proposals:
-                    break
-        else:
-            for i1, i2 in itertools.combinations(p1, r=2):
-                p1, p2 = vertical_photos[i1], vertical_photos[i2]
-                if p1 & p2 > 0:
-                    continue
 
-                pairs.append(p1 | p2)
-                if len(pairs) >= nb_proposals:
-                    break
+def _stitch_by_vertical_photos(
+    sequences, vertical_photos, proposals: List[ProposalBuffer], th=1, p_build=0.05
+):
+    if len(sequences) <= 1 or not any(len(x) <= th for x in vertical_photos):
+        return sequences, vertical_photos
 
-        used_pairs = _do_stitch_by_vertical_photos(
-            sequences, pairs, th=th, p_build=p_build
-        )
+    for buffer in proposals:
+        _do_stitch_by_vertical_photos(sequences, buffer, th=th, p_build=p_build)
 
-        # exclude used photos from vertical_photos
-        vertical_photos = [x for x in vertical_photos if x.id not in used_pairs]
+    # exclude used photos from vertical_photos
+    used_pairs = set().union(*[x.used_ids() for x in proposals])
+    vertical_photos = [x for x in vertical_photos if x.id not in used_pairs]
 
     assert all(sequence_lost_score(s) == 0 for s in sequences)
 
@@ -0,0 +1,50 @@
+import json
+import asyncio
+from typing import Optional
+from .server import SOCKET
+
+
+async def submit(
+    path: str,
+    out: Optional[str] = None,
+    priority: int = 0,
+    time_limit: Optional[float] = None,
+    optimizer: str = "2opt",
+    socket_path: str = SOCKET,
+    port: Optional[int] = None,
+    callback=print,
+) -> dict:
+    """
+    Send a job to the server and wait for it,
+    callback is called with every event, the final event is returned
+    (done or timeout with path to the submission, or error)
+    """
+    if port is not None:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+
+    job = dict(
+        path=path,
+        out=out,
+        priority=priority,
+        time_limit=time_limit,
+        optimizer=optimizer,
+    )
+    writer.write(json.dumps(job).encode() + b"\n")
+    await writer.drain()
+
+    try:
+        async for line in reader:
+            event = json.loads(line)
+            callback(event)
+            if event["event"] in ("done", "timeout", "error"):
+                break
+        else:
+            event = dict(event="error", message="Connection closed by the server.")
+            callback(event)
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    return event
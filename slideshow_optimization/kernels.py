@@ -0,0 +1,133 @@
+"""
+Scoring kernels over packed tag bitsets: each photo is a row of uint64 words.
+Numba versions are compiled when numba is installed, otherwise the numpy
+versions are used, both return the same int64 arrays.
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# number of set bits in each byte
+POPCOUNT = np.array([bin(x).count("1") for x in range(256)], dtype=np.int64)
+
+
+def overlaps_numpy(v: np.array, ar: np.array) -> np.array:
+    """ number of common tags between bitset v and each row of ar """
+    x = np.ascontiguousarray(np.bitwise_and(v, ar)).view(np.uint8)
+    return POPCOUNT[x].sum(axis=-1)
+
+
+def pair_scores_numpy(bits, sizes, a, b) -> np.array:
+    """ scores of pairs of photos (a[k], b[k]) """
+    overlap = overlaps_numpy(bits[a], bits[b])
+    return np.minimum.reduce([overlap, sizes[a] - overlap, sizes[b] - overlap])
+
+
+def edge_scores_numpy(bits, sizes, order) -> np.array:
+    """ scores of all transitions of the sequence order """
+    return pair_scores_numpy(bits, sizes, order[:-1], order[1:])
+
+
+def two_opt_gains_numpy(bits, sizes, order, i):
+    """
+    Gains of score and max score of reversing order[i:j] for all j in (i, n)
+    """
+    j = np.arange(i + 1, len(order))
+    l1, l2 = np.full(len(j), order[i - 1]), np.full(len(j), order[i])
+    r1, r2 = order[j - 1], order[j]
+
+    gains = (
+        pair_scores_numpy(bits, sizes, l1, r1)
+        + pair_scores_numpy(bits, sizes, l2, r2)
+        - pair_scores_numpy(bits, sizes, l1, l2)
+        - pair_scores_numpy(bits, sizes, r1, r2)
+    )
+
+    half = sizes // 2
+    max_gains = (
+        np.minimum(half[l1], half[r1])
+        + np.minimum(half[l2], half[r2])
+        - np.minimum(half[l1], half[l2])
+        - np.minimum(half[r1], half[r2])
+    )
+    return gains, max_gains
+
+
+if numba is not None:
+    M1 = np.uint64(0x5555555555555555)
+    M2 = np.uint64(0x3333333333333333)
+    M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+    H01 = np.uint64(0x0101010101010101)
+
+    @numba.njit(cache=True, inline="always")
+    def _popcount(x):
+        x = x - ((x >> np.uint64(1)) & M1)
+        x = (x & M2) + ((x >> np.uint64(2)) & M2)
+        x = (x + (x >> np.uint64(4))) & M4
+        return np.int64((x * H01) >> np.uint64(56))
+
+    @numba.njit(cache=True, inline="always")
+    def _score(bits, sizes, a, b):
+        overlap = 0
+        for w in range(bits.shape[1]):
+            overlap += _popcount(bits[a, w] & bits[b, w])
+        return min(overlap, sizes[a] - overlap, sizes[b] - overlap)
+
+    @numba.njit(cache=True)
+    def overlaps_numba(v, ar):
+        out = np.zeros(ar.shape[0], dtype=np.int64)
+        for k in range(ar.shape[0]):
+            for w in range(ar.shape[1]):
+                out[k] += _popcount(v[w] & ar[k, w])
+        return out
+
+    @numba.njit(cache=True)
+    def pair_scores_numba(bits, sizes, a, b):
+        out = np.zeros(len(a), dtype=np.int64)
+        for k in range(len(a)):
+            out[k] = _score(bits, sizes, a[k], b[k])
+        return out
+
+    @numba.njit(cache=True)
+    def edge_scores_numba(bits, sizes, order):
+        return pair_scores_numba(bits, sizes, order[:-1], order[1:])
+
+    @numba.njit(cache=True)
+    def two_opt_gains_numba(bits, sizes, order, i):
+        n = len(order)
+        gains = np.zeros(max(n - i - 1, 0), dtype=np.int64)
+        max_gains = np.zeros(max(n - i - 1, 0), dtype=np.int64)
+        l1, l2 = order[i - 1], order[i]
+        l12 = _score(bits, sizes, l1, l2)
+        max_l12 = min(sizes[l1] // 2, sizes[l2] // 2)
+        for j in range(i + 1, n):
+            r1, r2 = order[j - 1], order[j]
+            gains[j - i - 1] = (
+                _score(bits, sizes, l1, r1)
+                + _score(bits, sizes, l2, r2)
+                - l12
+                - _score(bits, sizes, r1, r2)
+            )
+            max_gains[j - i - 1] = (
+                min(sizes[l1] // 2, sizes[r1] // 2)
+                + min(sizes[l2] // 2, sizes[r2] // 2)
+                - max_l12
+                - min(sizes[r1] // 2, sizes[r2] // 2)
+            )
+        return gains, max_gains
+
+    BACKEND = "numba"
+    overlaps = overlaps_numba
+    pair_scores = pair_scores_numba
+    edge_scores = edge_scores_numba
+    two_opt_gains = two_opt_gains_numba
+else:
+    BACKEND = "numpy"
+    overlaps = overlaps_numpy
+    pair_scores = pair_scores_numpy
+    edge_scores = edge_scores_numpy
+    two_opt_gains = two_opt_gains_numpy
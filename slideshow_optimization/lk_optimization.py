@@ -0,0 +1,190 @@
+import time
+from typing import List, Callable, Optional
+from .utils import popcount, to_int_bits, sequence_score, sequence_max_score
+from .models import Photo
+from .preprocessing import check_compressed
+from .similarity_graph import build_similarity_graph
+
+MAX_SEGMENT_LENGTH = 3
+
+
+class Tour:
+    """
+    Open path over slides.
+    order -- node at each position, pos -- position of each node,
+    bits -- tags of each node as an int bitset
+    """
+
+    def __init__(self, order: List[int], bits: List[int], sizes: List[int]):
+        self.order = order
+        self.pos = [0] * len(order)
+        self.bits = bits
+        self.sizes = sizes
+        self.update_positions(0, len(order))
+
+    def __len__(self):
+        return len(self.order)
+
+    def update_positions(self, start: int, end: int):
+        order, pos = self.order, self.pos
+        for i in range(start, end):
+            pos[order[i]] = i
+
+    def score(self, a, b) -> int:
+        if a is None or b is None:
+            return 0
+        overlap = popcount(self.bits[a] & self.bits[b])
+        return min(overlap, self.sizes[a] - overlap, self.sizes[b] - overlap)
+
+    def max_score(self) -> int:
+        order, sizes = self.order, self.sizes
+        return sum(min(sizes[a], sizes[b]) // 2 for a, b in zip(order[:-1], order[1:]))
+
+    def at(self, i: int):
+        """ node at position i, None outside of the path """
+        if 0 <= i < len(self.order):
+            return self.order[i]
+        return None
+
+    def reverse(self, i: int, j: int):
+        """ reverse nodes at positions i..j (inclusive) """
+        self.order[i : j + 1] = self.order[i : j + 1][::-1]
+        self.update_positions(i, j + 1)
+
+    def move(self, i: int, length: int, k: int, reverse: bool):
+        """ move segment at positions i..i+length-1 to position k of the rest """
+        segment = self.order[i : i + length]
+        if reverse:
+            segment = segment[::-1]
+        rest = self.order[:i] + self.order[i + length :]
+        self.order[:] = rest[:k] + segment + rest[k:]
+        self.update_positions(min(i, k), max(i + length, k + length))
+
+
+def lk_optimization(
+    data: List[Photo],
+    time_limit: float = 60,
+    k: int = 16,
+    callback: Optional[Callable[[int, int], None]] = None,
+):
+    """
+    Or-opt / 2-opt sequential edge exchanges over the slideshow as an open path,
+    candidate moves are taken from the similarity graph
+    time_limit -- time budget in seconds
+    k -- number of candidate neighbours per slide
+    callback -- called with (score, max score) every 1000 moves
+    """
+    check_compressed(data)
+
+    print("LK optimization...")
+
+    if len(data) <= 2:
+        return data
+
+    graph = build_similarity_graph(data)
+    bits = to_int_bits(graph.photos)
+    sizes = [len(x) for x in graph.photos]
+    candidates = [
+        graph.indices[graph.indptr[r] : graph.indptr[r + 1]][:k].tolist()
+        for r in range(len(graph))
+    ]
+
+    tour = Tour([graph.index[x.id] for x in data], bits, sizes)
+
+    start_time = time.time()
+    score = sequence_score(data)
+    max_score = sequence_max_score(data)
+    print(f"Score = {score} / {max_score}")
+
+    # don't look bits: only nodes from the queue are tried as move starts
+    queue = list(tour.order)
+    active = set(queue)
+    nb_moves = 0
+    while queue and time.time() - start_time < time_limit:
+        a = queue.pop()
+        active.discard(a)
+
+        touched = _try_2opt(tour, a, candidates[a]) or _try_or_opt(tour, a, candidates)
+        if touched is None:
+            continue
+
+        gain, nodes = touched
+        score += gain
+        nb_moves += 1
+        for x in nodes:
+            if x is not None and x not in active:
+                active.add(x)
+                queue.append(x)
+
+        if nb_moves % 1000 == 0:
+            max_score = tour.max_score()
+            print(f"Score = {score} / {max_score}")
+            if callback is not None:
+                callback(score, max_score)
+
+    print("Done.")
+    max_score = tour.max_score()
+    print(f"Score = {score} / {max_score}")
+
+    return [graph.photos[x] for x in tour.order]
+
+
+def _try_2opt(tour: Tour, a, candidates):
+    """ reverse a part of the path to put a next to one of its candidates """
+    at, score = tour.at, tour.score
+    for c in candidates:
+        i, j = sorted((tour.pos[a], tour.pos[c]))
+        if j == i + 1:
+            continue
+
+        # reversing i+1..j or i..j-1 makes a and c adjacent,
+        # positions -1 and n stand for the open ends of the path
+        for i, j in ((i, j), (i - 1, j - 1)):
+            t1, t2, t3, t4 = at(i), at(i + 1), at(j), at(j + 1)
+            gain = score(t1, t3) + score(t2, t4) - score(t1, t2) - score(t3, t4)
+            if gain > 0:
+                tour.reverse(i + 1, j)
+                return gain, (t1, t2, t3, t4)
+
+    return None
+
+
+def _try_or_opt(tour: Tour, a, candidates):
+    """ move a short segment which starts or ends with a next to a candidate """
+    n = len(tour)
+    at, score = tour.at, tour.score
+    pa = tour.pos[a]
+    for length in range(1, MAX_SEGMENT_LENGTH + 1):
+        for i in (pa, pa - length + 1):
+            if i < 0 or i + length > n or length == n:
+                continue
+
+            s0, s1 = at(i), at(i + length - 1)
+            p, nx = at(i - 1), at(i + length)
+            removal_loss = score(p, s0) + score(s1, nx) - score(p, nx)
+
+            for e in (s0, s1) if length > 1 else (s0,):
+                for c in candidates[e]:
+                    k = tour.pos[c]
+                    if i <= k < i + length:
+                        continue
+
+                    # position of c after the segment is removed
+                    kr = k if k < i else k - length
+                    for after in (True, False):
+                        if after:
+                            b, d = c, at(k + 1) if k + 1 != i else nx
+                            insert_at = kr + 1
+                        else:
+                            b, d = at(k - 1) if k - 1 != i + length - 1 else p, c
+                            insert_at = kr
+
+                        # segment end e must be adjacent to c
+                        reverse = (e == s0) != after
+                        x, y = (s1, s0) if reverse else (s0, s1)
+                        gain = score(b, x) + score(y, d) - score(b, d) - removal_loss
+                        if gain > 0:
+                            tour.move(i, length, insert_at, reverse)
+                            return gain, (p, nx, b, d, s0, s1)
+
+    return None
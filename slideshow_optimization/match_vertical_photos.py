@@ -1,12 +1,19 @@
+import time
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from typing import List
-from .utils import to_array
+from .utils import to_array, nb_tags
 from .models import Photo, Orientation
+from .preprocessing import check_compressed
 
 
-def match_vertical_photos(photos: List[Photo], max_tags_in_photo=22):
+def match_vertical_photos(photos: List[Photo], max_tags_in_photo=22, deadline=None):
+    """
+    deadline -- time.time() after which the remaining photos are paired in order
+    """
+    check_compressed(photos)
+
     if not all([x.orientation == Orientation.Vertical for x in photos]):
         raise ValueError("All photos must be vertical.")
 
@@ -17,16 +24,23 @@ def match_vertical_photos(photos: List[Photo], max_tags_in_photo=22):
 
     np.random.seed(17)
     photos = sorted(photos, key=lambda x: -len(x))
-    all_tags = sorted(set([x for x in map(lambda x: x.tags, photos) for x in x]))
-    data = to_array(photos, all_tags)
+    data = to_array(photos, nb_tags(photos))
     df = pd.DataFrame(data, index=photos)
+    private = np.array([x.private for x in photos])
 
     pairs = []
     bar = tqdm(total=len(df))
     while len(df) > 0:
+        if deadline is not None and time.time() >= deadline:
+            rest = list(df.index)
+            pairs += [p1 | p2 for p1, p2 in zip(rest[::2], rest[1::2])]
+            bar.update(n=len(rest))
+            break
+
         photo, proposals = df.iloc[0].values, df.iloc[1:].values
 
         num_tags_if_paired = np.sum(np.logical_or(photo, proposals), axis=1)
+        num_tags_if_paired += private[0] + private[1:]
         overlap = np.sum(np.logical_and(photo, proposals), axis=1)
 
         score = (
@@ -43,7 +57,8 @@ def match_vertical_photos(photos: List[Photo], max_tags_in_photo=22):
         i1, i2 = 0, 1 + np.random.choice(best_proposals)
         p1, p2 = df.index[i1], df.index[i2]
         pairs.append(p1 | p2)
-        df = df.iloc[[x for x in range(len(df)) if x not in (i1, i2)]]
+        remaining = [x for x in range(len(df)) if x not in (i1, i2)]
+        df, private = df.iloc[remaining], private[remaining]
         bar.update(n=2)
 
     bar.close()
@@ -20,6 +20,8 @@ class Photo:
     id: Union[int, tuple]
     tags: set
     orientation: Orientation
+    # number of tags which no other photo has
+    private: int = 0
 
     @classmethod
     def from_string(cls, id: int, line: str) -> "Photo":
@@ -35,13 +37,13 @@ class Photo:
         return Photo(id=id, tags=set(tags), orientation=orient)
 
     def __len__(self):
-        return len(self.tags)
+        return len(self.tags) + self.private
 
     def __and__(self, other):
         return len(self.tags & other.tags)
 
     def __sub__(self, other):
-        return len(self.tags - other.tags)
+        return len(self.tags - other.tags) + self.private
 
     def __or__(self, other):
         if (
@@ -54,6 +56,7 @@ class Photo:
             id=(self.id, other.id),
             tags=self.tags | other.tags,
             orientation=Orientation.Combined,
+            private=self.private + other.private,
         )
 
     def __hash__(self):
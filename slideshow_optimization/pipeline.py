@@ -0,0 +1,72 @@
+import time
+from typing import List, Tuple, Callable, Optional
+from .utils import sequence_score, sequence_max_score
+from .models import Photo
+from .arrange_photos import arrange_photos
+from .lk_optimization import lk_optimization
+from .post_processing import post_processing
+from .match_vertical_photos import match_vertical_photos
+
+OPTIMIZERS = ("2opt", "lk")
+
+
+def create_slideshow(
+    data: List[Photo],
+    optimizer: str = "2opt",
+    time_limit: float = 60,
+    deadline: Optional[float] = None,
+    callback: Optional[Callable[[str, int, int], None]] = None,
+) -> Tuple[List[Photo], bool]:
+    """
+    Full pipeline: arrange photos, match vertical photos, arrange all slides,
+    post processing with optimizer.
+    Returns the slideshow and False if some stage was cut short by the deadline.
+    time_limit -- time budget of lk optimizer
+    deadline -- time.time() after which all stages are stopped (or skipped)
+    callback -- called with (stage, score, max score) to report progress
+    """
+    if optimizer not in OPTIMIZERS:
+        raise ValueError("Unknown optimizer: '{}'.".format(optimizer))
+
+    def report(stage, slideshow):
+        if callback is not None:
+            callback(stage, sequence_score(slideshow), sequence_max_score(slideshow))
+
+    def out_of_time():
+        return deadline is not None and time.time() >= deadline
+
+    slideshow, vertical_photos = arrange_photos(data, deadline=deadline)
+    report("arrange", slideshow)
+    combine_photos = match_vertical_photos(vertical_photos, deadline=deadline)
+    slideshow, _ = arrange_photos(slideshow + combine_photos, deadline=deadline)
+    report("arrange", slideshow)
+
+    if out_of_time():
+        print(f"# {optimizer}: skipped, out of time")
+        return slideshow, False
+
+    budget = time_limit if optimizer == "lk" else None
+    if deadline is not None:
+        remaining = deadline - time.time()
+        budget = remaining if budget is None or remaining < budget else budget
+
+    def optimizer_callback(score, max_score):
+        if callback is not None:
+            callback(optimizer, score, max_score)
+
+    start_time, start_score = time.time(), sequence_score(slideshow)
+    if optimizer == "lk":
+        slideshow = lk_optimization(
+            slideshow, time_limit=budget, callback=optimizer_callback
+        )
+    else:
+        slideshow = post_processing(
+            slideshow, time_limit=budget, callback=optimizer_callback
+        )
+    elapsed = time.time() - start_time
+    gain = sequence_score(slideshow) - start_score
+    rate = gain / elapsed if elapsed > 0 else 0.0
+    print(f"# {optimizer}: gain = {gain} in {elapsed:.1f}s, {rate:.1f} per second")
+    report(optimizer, slideshow)
+
+    return slideshow, not out_of_time()
@@ -1,5 +1,10 @@
-from typing import List
+import time
+import numpy as np
+from typing import List, Callable, Optional
+from . import kernels
 from .utils import (
+    to_bits,
+    nb_tags,
     calc_score,
     sequence_score,
     calc_max_score,
@@ -7,9 +12,25 @@ from .utils import (
     sequence_max_score,
 )
 from .models import Photo
+from .preprocessing import check_compressed
+from .similarity_graph import SimilarityGraph, build_similarity_graph
+
+
+def post_processing(
+    data: List[Photo],
+    time_limit: Optional[float] = None,
+    callback: Optional[Callable[[int, int], None]] = None,
+):
+    """
+    time_limit -- time budget in seconds, no limit by default
+    callback -- called with (score, max score) after each pass
+    """
+    start_time = time.time()
+    check_compressed(data)
+    graph = build_similarity_graph(data)
+    bits = to_bits(graph.photos, nb_tags(data))
+    sizes = np.array([len(x) for x in graph.photos], dtype=np.int64)
 
-
-def post_processing(data: List[Photo]):
     print("Post processing...")
     nb_attempts = 0
     previous_score = 0
@@ -18,6 +39,11 @@ def post_processing(data: List[Photo]):
         score = sequence_score(data)
         max_score = sequence_max_score(data)
         print(f"Score = {score} / {max_score}")
+        if callback is not None:
+            callback(score, max_score)
+
+        if time_limit is not None and time.time() - start_time >= time_limit:
+            break
 
         if score <= previous_score:
             nb_attempts += 1
@@ -31,7 +57,7 @@ def post_processing(data: List[Photo]):
                 break
         previous_score = score
 
-        data = _improve(data[::-1], greedy=greedy)
+        data = _improve(data[::-1], graph, bits, sizes, greedy=greedy)
 
     print("Done.")
     score = sequence_score(data)
@@ -45,11 +71,16 @@ def _partial_reverse(sequence, start, end):
     return sequence[:start] + sequence[start:end][::-1] + sequence[end:]
 
 
-def _do_improve(sequence, i, greedy=False):
+def _do_improve(sequence, i, graph, positions, bits, sizes, order, greedy=False):
+    """ find j such that reversing sequence[i:j] improves the score """
     l1, l2 = sequence[i - 1], sequence[i]
     l12, max_l12 = lazy_calc_score(l1, l2), calc_max_score(l1, l2)
-    for j in range(i + 1, len(sequence)):
-        r1, r2 = sequence[j - 1], sequence[j]
+    for r1, lr1, _ in graph.neighbours(l1):
+        j = positions[r1.id] + 1
+        if j <= i + 1 or j >= len(sequence):
+            continue
+
+        r2 = sequence[j]
         max_r12 = calc_max_score(r1, r2)
         current_max_score = max_l12 + max_r12
 
@@ -63,22 +94,41 @@ def _do_improve(sequence, i, greedy=False):
         r12 = lazy_calc_score(r1, r2)
         current_score = l12 + r12
 
-        lr1 = calc_score(l1, r1)
         lr2 = calc_score(l2, r2)
         new_score = lr1 + lr2
 
         if new_score > current_score:
-            sequence = _partial_reverse(sequence, i, j)
-            break
+            return j
 
-    return sequence
+    # none of the neighbours helps (the list is truncated at k),
+    # scan all the reversals with the same filter
+    gains, max_gains = kernels.two_opt_gains(bits, sizes, order, i)
+    found = np.flatnonzero((gains > 0) if greedy else (gains > 0) & (max_gains >= 0))
+    if len(found) > 0:
+        return i + 1 + int(found[0])
+
+    return None
+
+
+def _improve(submission, graph: SimilarityGraph, bits, sizes, greedy=False):
+    positions = {p.id: i for i, p in enumerate(submission)}
+    order = np.array([graph.index[p.id] for p in submission])
+
+    scores = kernels.edge_scores(bits, sizes, order)
+    max_scores = np.minimum(sizes[order[:-1]], sizes[order[1:]]) // 2
+    for i in (np.flatnonzero(scores < max_scores) + 1).tolist():
+        # the sequence may have changed since the edges were scored
+        p1, p2 = submission[i - 1], submission[i]
+        if lazy_calc_score(p1, p2) >= calc_max_score(p1, p2):
+            continue
 
+        j = _do_improve(
+            submission, i, graph, positions, bits, sizes, order, greedy=greedy
+        )
+        if j is not None:
+            submission = _partial_reverse(submission, i, j)
+            order[i:j] = order[i:j][::-1].copy()
+            for k in range(i, j):
+                positions[submission[k].id] = k
 
-def _improve(submission, greedy=False):
-    p1 = submission[0]
-    for i in range(1, len(submission)):
-        p2 = submission[i]
-        if lazy_calc_score(p1, p2) < calc_max_score(p1, p2):
-            submission = _do_improve(submission, i, greedy=greedy)
-        p1 = p2
     return submission
@@ -0,0 +1,45 @@
+from collections import Counter
+from typing import List
+from .models import Photo
+from .utils import COMPRESS_TAGS_FIRST
+
+
+def compress_tags(data: List[Photo]) -> List[Photo]:
+    """
+    Tags which occur only once can't add to any transition score,
+    they are replaced with a per-photo counter (Photo.private).
+    The remaining tags are remapped to ids 0..n-1, the most frequent tags first.
+    """
+    frequency = Counter(t for x in data for t in x.tags)
+    shared = sorted(
+        (t for t, c in frequency.items() if c > 1),
+        key=lambda t: (-frequency[t], str(t)),
+    )
+    tag_ids = {t: i for i, t in enumerate(shared)}
+
+    print(f"Number of tags: {len(frequency)}, shared: {len(tag_ids)}")
+
+    return [
+        Photo(
+            id=x.id,
+            tags={tag_ids[t] for t in x.tags if t in tag_ids},
+            orientation=x.orientation,
+            private=x.private + sum(t not in tag_ids for t in x.tags),
+        )
+        for x in data
+    ]
+
+
+def is_compressed(data: List[Photo]) -> bool:
+    """ True if all tags are ids given by compress_tags """
+    return all(isinstance(t, int) for x in data for t in x.tags)
+
+
+def check_compressed(data: List[Photo]):
+    """
+    Raise ValueError for raw photos (as returned by read_file),
+    compress_tags must run once on the whole dataset: compressing a subset
+    gives tag ids which don't match the ids of the other photos
+    """
+    if not is_compressed(data):
+        raise ValueError(COMPRESS_TAGS_FIRST)
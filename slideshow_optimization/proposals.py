@@ -0,0 +1,106 @@
+import itertools
+import numpy as np
+from typing import List
+from .utils import to_bits
+from .models import Photo
+
+
+class ProposalBuffer:
+    """
+    Fixed size buffer of vertical photo pairs (proposals).
+    Pairs are kept as indices into photos_1 and photos_2 together with
+    their combined (OR-ed) packed bitsets, the photo pair itself is only created
+    when the proposal is consumed. Consumed entries and entries which share
+    a photo with them are refilled from a lazy pair generator.
+    """
+
+    def __init__(
+        self, photos_1: List[Photo], photos_2: List[Photo], nb_tags: int, size: int
+    ):
+        self.same = photos_1 is photos_2
+        self.photos = (photos_1, photos_2)
+        bits_1 = to_bits(photos_1, nb_tags)
+        self.bits = (bits_1, bits_1 if self.same else to_bits(photos_2, nb_tags))
+        used_1 = np.zeros(len(photos_1), dtype=bool)
+        self.used = (used_1, used_1 if self.same else np.zeros(len(photos_2), bool))
+
+        self.pairs = np.zeros((size, 2), dtype=np.int32)
+        self.pair_bits = np.zeros((size, bits_1.shape[1]), dtype=bits_1.dtype)
+        self.pair_sizes = np.zeros(size, dtype=np.int32)
+        self.valid = np.zeros(size, dtype=bool)
+        self._generator = None
+
+    def _generate(self):
+        """ all compatible pairs of unused photos in random order """
+        p1 = np.where(~self.used[0])[0]
+        p2 = p1 if self.same else np.where(~self.used[1])[0]
+        np.random.shuffle(p1)
+        if not self.same:
+            np.random.shuffle(p2)
+
+        if self.same:
+            pairs = itertools.combinations(p1.tolist(), r=2)
+        else:
+            pairs = itertools.product(p1.tolist(), p2.tolist())
+
+        photos_1, photos_2 = self.photos
+        used_1, used_2 = self.used
+        for i1, i2 in pairs:
+            if used_1[i1] or used_2[i2]:
+                continue
+
+            if photos_1[i1] & photos_2[i2] > 0:
+                continue
+
+            yield i1, i2
+
+    def fill(self):
+        """ replace consumed entries with new pairs """
+        free = np.where(~self.valid)[0]
+        if len(free) == 0:
+            return
+
+        restart = self._generator is None
+        if restart:
+            self._generator = self._generate()
+            in_buffer = set(map(tuple, self.pairs[self.valid].tolist()))
+
+        new_pairs = []
+        for pair in self._generator:
+            if restart and pair in in_buffer:
+                continue
+
+            new_pairs.append(pair)
+            if len(new_pairs) >= len(free):
+                break
+        else:
+            # generator is exhausted, start a new pass on the next fill
+            self._generator = None
+
+        if not new_pairs:
+            return
+
+        photos_1, photos_2 = self.photos
+        free = free[: len(new_pairs)]
+        new_pairs = np.array(new_pairs, dtype=np.int32)
+        self.pairs[free] = new_pairs
+        self.pair_bits[free] = (
+            self.bits[0][new_pairs[:, 0]] | self.bits[1][new_pairs[:, 1]]
+        )
+        self.pair_sizes[free] = [
+            len(photos_1[i1]) + len(photos_2[i2]) for i1, i2 in new_pairs
+        ]
+        self.valid[free] = True
+
+    def consume(self, k: int) -> Photo:
+        """ take the pair from entry k and drop all entries with the same photos """
+        i1, i2 = self.pairs[k]
+        self.used[0][i1] = True
+        self.used[1][i2] = True
+        self.valid &= ~(self.used[0][self.pairs[:, 0]] | self.used[1][self.pairs[:, 1]])
+        return self.photos[0][i1] | self.photos[1][i2]
+
+    def used_ids(self) -> set:
+        ids = {p.id for p, used in zip(self.photos[0], self.used[0]) if used}
+        ids.update(p.id for p, used in zip(self.photos[1], self.used[1]) if used)
+        return ids
@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import signal
+import asyncio
+import tempfile
+import itertools
+import threading
+import multiprocessing
+import numpy as np
+from functools import lru_cache
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from . import kernels
+from .utils import read_file, create_submission, sequence_score, sequence_max_score
+from .pipeline import OPTIMIZERS, create_slideshow
+from .preprocessing import compress_tags
+
+SOCKET = os.path.join(tempfile.gettempdir(), "slideshow_optimization.sock")
+
+_WORKER = {}
+
+
+def _init_worker(events):
+    # Ctrl-C is handled by the server, running jobs are finished
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _WORKER["events"] = events
+
+
+def _warm_up():
+    """ compile (or load) the scoring kernels """
+    bits = np.zeros((2, 1), dtype=np.uint64)
+    sizes = np.zeros(2, dtype=np.int64)
+    kernels.edge_scores(bits, sizes, np.arange(2))
+    return os.getpid()
+
+
+@lru_cache(maxsize=16)
+def _load(path: str, mtime: int, size: int):
+    """ parsed and compressed input, cached per worker by path and file stat """
+    return compress_tags(read_file(path))
+
+
+def _run_job(job_id: int, path: str, out: str, optimizer: str, time_limit: float):
+    """
+    Run the pipeline in a worker process, all events of the job
+    (including the final one) are sent through the shared queue
+    """
+    events = _WORKER["events"]
+
+    def send(event, **kwargs):
+        events.put((job_id, dict(event=event, job=job_id, **kwargs)))
+
+    def callback(stage, score, max_score):
+        send("progress", stage=stage, score=score, max_score=max_score)
+
+    try:
+        start_time = time.time()
+        stat = os.stat(path)
+        hits = _load.cache_info().hits
+        data = _load(path, stat.st_mtime_ns, stat.st_size)
+        send("started", pid=os.getpid(), cached=_load.cache_info().hits > hits)
+
+        slideshow, complete = create_slideshow(
+            data,
+            optimizer=optimizer,
+            time_limit=time_limit,
+            deadline=start_time + time_limit,
+            callback=callback,
+        )
+        create_submission(slideshow, out)
+
+        send(
+            "done" if complete else "timeout",
+            out=out,
+            score=sequence_score(slideshow),
+            max_score=sequence_max_score(slideshow),
+            elapsed=time.time() - start_time,
+        )
+    except Exception as e:
+        send("error", message=f"{type(e).__name__}: {e}")
+
+
+class JobServer:
+    """
+    Asyncio server which runs slideshow jobs on a pool of warm worker processes.
+    Protocol: a client sends one json line with the job
+    {"path", "out", "priority", "time_limit", "optimizer"},
+    the server answers with json lines of events:
+    queued, started, progress (stage, score, max_score), and then
+    done (out, score), timeout (same as done, but some stages were cut short
+    by the time limit) or error.
+    Jobs with lower priority value run first. time_limit is the time budget
+    of the whole job, every stage is stopped (or skipped) when it is over.
+    By default the submission is saved next to the input with the job id in its name,
+    a job can't use an output path of another unfinished job.
+    """
+
+    def __init__(self, nb_workers: int = 2, time_limit: float = 600):
+        self.nb_workers = nb_workers
+        self.time_limit = time_limit
+        self.streams = {}
+        # output path -> id of the unfinished job which writes it
+        self.outputs = {}
+        self.counter = itertools.count()
+        self.queue = None
+        self.executor = None
+
+    async def serve(self, path: Optional[str] = SOCKET, port: Optional[int] = None):
+        """ listen on localhost:port if port is set, otherwise on unix socket path """
+        loop = asyncio.get_running_loop()
+        self.queue = asyncio.PriorityQueue()
+
+        events = multiprocessing.Queue()
+        executor = ProcessPoolExecutor(
+            self.nb_workers, initializer=_init_worker, initargs=(events,)
+        )
+        self.executor = executor
+
+        pids = await asyncio.gather(
+            *[loop.run_in_executor(executor, _warm_up) for _ in range(self.nb_workers)]
+        )
+        print(f"Workers are ready: {sorted(set(pids))}")
+
+        # daemon thread, it must not keep the server alive when the loop is closed
+        threading.Thread(target=self._forward, args=(events, loop), daemon=True).start()
+        tasks = [asyncio.create_task(self._schedule()) for _ in range(self.nb_workers)]
+
+        if port is not None:
+            server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        else:
+            server = await asyncio.start_unix_server(self._handle, path)
+        print(f"Listening on {port if port is not None else path}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+            print("Waiting for running jobs...")
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _forward(self, events, loop):
+        """ move events from worker processes to the job streams (in a thread) """
+        while True:
+            job_id, event = events.get()
+            try:
+                loop.call_soon_threadsafe(self._dispatch, job_id, event)
+            except RuntimeError:
+                # loop is closed
+                break
+
+    def _dispatch(self, job_id: int, event: dict):
+        stream = self.streams.get(job_id)
+        if stream is not None:
+            stream.put_nowait(event)
+
+    async def _schedule(self):
+        """ take jobs from the priority queue and run them one by one """
+        loop = asyncio.get_running_loop()
+        while True:
+            _, job_id, job = await self.queue.get()
+            if job_id not in self.streams:
+                # client has gone before the job started
+                self.outputs.pop(job["out"], None)
+                continue
+
+            try:
+                await loop.run_in_executor(
+                    self.executor,
+                    _run_job,
+                    job_id,
+                    job["path"],
+                    job["out"],
+                    job["optimizer"],
+                    job["time_limit"],
+                )
+            except Exception as e:
+                stream = self.streams.get(job_id)
+                if stream is not None:
+                    message = f"{type(e).__name__}: {e}"
+                    stream.put_nowait(dict(event="error", job=job_id, message=message))
+            finally:
+                self.outputs.pop(job["out"], None)
+
+    def _parse(self, job_id: int, line: bytes) -> dict:
+        request = json.loads(line)
+        path = os.path.abspath(request["path"])
+        if not os.path.isfile(path):
+            raise ValueError(f"No such file: '{path}'.")
+
+        optimizer = request.get("optimizer", "2opt")
+        if optimizer not in OPTIMIZERS:
+            raise ValueError(f"Unknown optimizer: '{optimizer}'.")
+
+        out = request.get("out")
+        if not out:
+            out = f"{os.path.splitext(path)[0]}_submission_{job_id}.txt"
+        out = os.path.abspath(out)
+        if out in self.outputs:
+            raise ValueError(f"Output '{out}' is in use by job {self.outputs[out]}.")
+
+        return {
+            "path": path,
+            "out": out,
+            "optimizer": optimizer,
+            "priority": int(request.get("priority", 0)),
+            "time_limit": float(request.get("time_limit") or self.time_limit),
+        }
+
+    async def _handle(self, reader, writer):
+        job_id = next(self.counter)
+
+        async def send(event):
+            writer.write(json.dumps(event).encode() + b"\n")
+            await writer.drain()
+
+        try:
+            try:
+                job = self._parse(job_id, await reader.readline())
+            except (ValueError, KeyError, TypeError) as e:
+                await send(dict(event="error", job=job_id, message=str(e)))
+                return
+
+            stream = self.streams[job_id] = asyncio.Queue()
+            self.outputs[job["out"]] = job_id
+            await self.queue.put((job["priority"], job_id, job))
+            await send(dict(event="queued", job=job_id, position=self.queue.qsize()))
+
+            while True:
+                event = await stream.get()
+                await send(event)
+                if event["event"] in ("done", "timeout", "error"):
+                    break
+        except ConnectionError:
+            # the job keeps running, its submission is written anyway
+            pass
+        finally:
+            self.streams.pop(job_id, None)
+            writer.close()
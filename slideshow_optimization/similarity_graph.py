@@ -0,0 +1,296 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+from tqdm import tqdm
+from typing import List, Optional
+from multiprocessing import Pool
+from .utils import lazy_calc_score
+from .models import Photo
+
+ARRAYS = ("indptr", "indices", "scores", "overlaps")
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "slideshow_optimization",
+)
+
+_WORKER = {}
+
+
+class SimilarityGraph:
+    """
+    Sparse top-k neighbour graph over slides stored in CSR format.
+    For each slide (row) we keep up to k neighbours with the highest
+    transition score together with the number of common tags.
+    If the graph is built by size, neighbours are taken only from the same
+    size class (len(photo) // 2), as arrange_photos processes them.
+    """
+
+    def __init__(
+        self, photos: List[Photo], indptr, indices, scores, overlaps, k: int = 32
+    ):
+        self.photos = photos
+        self.k = k
+        self.index = {p.id: i for i, p in enumerate(photos)}
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self.overlaps = overlaps
+
+    def __len__(self):
+        return len(self.photos)
+
+    def __contains__(self, photo: Photo):
+        return photo.id in self.index
+
+    def neighbours(self, photo: Photo):
+        """
+        List of (neighbour, score, overlap) sorted by score in descending order
+        """
+        row = self.index.get(photo.id)
+        if row is None:
+            return []
+
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return [
+            (self.photos[j], s, o)
+            for j, s, o in zip(
+                self.indices[start:end].tolist(),
+                self.scores[start:end].tolist(),
+                self.overlaps[start:end].tolist(),
+            )
+        ]
+
+    def is_complete(self, photo: Photo, th: int) -> bool:
+        """
+        True if the neighbour list of the photo has all photos with score >= th,
+        i.e. it was not cut at k neighbours while scores were still >= th
+        """
+        row = self.index.get(photo.id)
+        if row is None:
+            return False
+
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return end - start < self.k or self.scores[end - 1] < th
+
+    def candidates(self, photo: Photo, th: int, pool: dict):
+        """
+        Photos from pool (photo id -> photo) which have score >= th with the photo,
+        falls back to a full scan of the pool if the photo is not a node of the graph
+        or none of its neighbours is left in the pool and the list was truncated
+        """
+        if photo in self:
+            out = [x for x, s, _ in self.neighbours(photo) if s >= th and x.id in pool]
+            if out or self.is_complete(photo, th):
+                return out
+
+        return [
+            x
+            for x in pool.values()
+            if x.id != photo.id and lazy_calc_score(photo, x) >= th
+        ]
+
+
+def graph_hash(
+    photos: List[Photo], k: int, max_tag_frequency: int, by_size: bool = False
+) -> str:
+    h = hashlib.sha1(f"{k}:{max_tag_frequency}:{int(by_size)}".encode())
+    for photo in photos:
+        tags = " ".join(map(str, sorted(photo.tags)))
+        h.update(f"{photo.id}:{photo.private}:{tags}\n".encode())
+    return h.hexdigest()
+
+
+def build_similarity_graph(
+    photos: List[Photo],
+    k: int = 32,
+    max_tag_frequency: int = 10000,
+    nb_workers: Optional[int] = None,
+    chunk_size: int = 1000,
+    cache_dir: Optional[str] = CACHE_DIR,
+    max_cache_entries: int = 32,
+    by_size: bool = False,
+) -> SimilarityGraph:
+    """
+    Build (or load from cache) top-k neighbour graph over photos
+    k -- max number of neighbours per photo
+    max_tag_frequency -- tags which occur more often are not used to find candidates
+    cache_dir -- directory with memory-mapped graphs, None to disable cache
+    max_cache_entries -- number of graphs to keep, least recently used are removed
+    by_size -- take neighbours only from the same size class (len(photo) // 2)
+    """
+    photos = sorted(photos, key=lambda x: str(x.id))
+
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(
+            cache_dir,
+            "similarity_graph",
+            graph_hash(photos, k, max_tag_frequency, by_size),
+        )
+        if os.path.isdir(path):
+            # mark as recently used
+            os.utime(path)
+            arrays = [
+                np.load(os.path.join(path, f"{x}.npy"), mmap_mode="r") for x in ARRAYS
+            ]
+            return SimilarityGraph(photos, *arrays, k=k)
+
+    arrays = _build(photos, k, max_tag_frequency, by_size, nb_workers, chunk_size)
+
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+        for name, array in zip(ARRAYS, arrays):
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # built concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        _evict(os.path.dirname(path), max_cache_entries)
+        arrays = [
+            np.load(os.path.join(path, f"{x}.npy"), mmap_mode="r") for x in ARRAYS
+        ]
+
+    return SimilarityGraph(photos, *arrays, k=k)
+
+
+def _evict(root: str, max_entries: int):
+    """ remove least recently used graphs above max_entries """
+    entries = []
+    for name in os.listdir(root):
+        if len(name) != 40:
+            # temporary directory of a graph which is being saved
+            continue
+        try:
+            entries.append((os.path.getmtime(os.path.join(root, name)), name))
+        except OSError:
+            continue
+
+    for _, name in sorted(entries, reverse=True)[max_entries:]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+def clear_cache(cache_dir: str = CACHE_DIR):
+    """ remove all cached graphs """
+    shutil.rmtree(os.path.join(cache_dir, "similarity_graph"), ignore_errors=True)
+
+
+def _build(photos, k, max_tag_frequency, by_size, nb_workers, chunk_size):
+    tag_ids = {}
+    tags = []
+    for photo in photos:
+        tags.append(
+            np.array(
+                [tag_ids.setdefault(t, len(tag_ids)) for t in photo.tags],
+                dtype=np.int32,
+            )
+        )
+    sizes = np.array([len(x) for x in photos], dtype=np.int32)
+
+    # inverted index: tag -> photos, frequent tags are skipped
+    postings = [[] for _ in range(len(tag_ids))]
+    for i, t in enumerate(tags):
+        for x in t.tolist():
+            postings[x].append(i)
+    postings = [
+        np.array(x, dtype=np.int32) if len(x) <= max_tag_frequency else None
+        for x in postings
+    ]
+
+    # size class of every photo, -1 to take neighbours of any size
+    groups = sizes // 2 if by_size else np.full(len(photos), -1, dtype=np.int32)
+
+    state = {
+        "tags": tags,
+        "sizes": sizes,
+        "groups": groups,
+        "postings": postings,
+        "k": k,
+    }
+    chunks = [
+        (start, min(start + chunk_size, len(photos)))
+        for start in range(0, len(photos), chunk_size)
+    ]
+
+    bar = tqdm(total=len(photos), desc="Building similarity graph")
+    if len(chunks) <= 1 or nb_workers == 1:
+        _init_worker(state)
+        results = []
+        for chunk in chunks:
+            results.append(_build_chunk(chunk))
+            bar.update(chunk[1] - chunk[0])
+    else:
+        with Pool(nb_workers, initializer=_init_worker, initargs=(state,)) as pool:
+            results = []
+            for result in pool.imap(_build_chunk, chunks):
+                results.append(result)
+                bar.update(len(result[0]))
+    bar.close()
+
+    counts = np.concatenate([[0]] + [x[0] for x in results])
+    indptr = np.cumsum(counts).astype(np.int64)
+    indices = np.concatenate([x[1] for x in results]).astype(np.int32)
+    scores = np.concatenate([x[2] for x in results]).astype(np.int16)
+    overlaps = np.concatenate([x[3] for x in results]).astype(np.int16)
+    return indptr, indices, scores, overlaps
+
+
+def _init_worker(state):
+    _WORKER.update(state)
+
+
+def _build_chunk(chunk):
+    tags, sizes, groups, postings, k = (
+        _WORKER["tags"],
+        _WORKER["sizes"],
+        _WORKER["groups"],
+        _WORKER["postings"],
+        _WORKER["k"],
+    )
+    tag_sets = None
+
+    counts, indices, scores, overlaps = [], [], [], []
+    for i in range(*chunk):
+        lists = [postings[t] for t in tags[i].tolist() if postings[t] is not None]
+        if lists:
+            candidates, overlap = np.unique(np.concatenate(lists), return_counts=True)
+            mask = (candidates != i) & (groups[candidates] == groups[i])
+            candidates, overlap = candidates[mask], overlap[mask]
+        else:
+            candidates = overlap = np.zeros(0, dtype=np.int32)
+
+        if len(lists) < len(tags[i]) and len(candidates) > 0:
+            # some tags were skipped, count the overlap of the best candidates exactly
+            if tag_sets is None:
+                tag_sets = [set(x.tolist()) for x in tags]
+            best = np.argsort(-overlap, kind="stable")[: 4 * k]
+            candidates = candidates[best]
+            tags_i = tag_sets[i]
+            overlap = np.array(
+                [len(tags_i & tag_sets[j]) for j in candidates.tolist()],
+                dtype=np.int64,
+            )
+
+        score = np.minimum.reduce(
+            [overlap, sizes[i] - overlap, sizes[candidates] - overlap]
+        )
+        # ties: the smallest overlap first, so links with overlap == score go first
+        best = np.lexsort((overlap, -score))[:k]
+        best = best[score[best] > 0]
+
+        counts.append(len(best))
+        indices.append(candidates[best])
+        scores.append(score[best])
+        overlaps.append(overlap[best])
+
+    empty = np.zeros(0, dtype=np.int32)
+    return (
+        np.array(counts, dtype=np.int64),
+        np.concatenate(indices) if indices else empty,
+        np.concatenate(scores) if scores else empty,
+        np.concatenate(overlaps) if overlaps else empty,
+    )
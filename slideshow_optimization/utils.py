@@ -1,11 +1,16 @@
 import numpy as np
 from typing import List, Callable, Union
 from functools import lru_cache
+from . import kernels
 from .models import Photo, Orientation
 
+# sequences shorter than this are scored with set operations
+MIN_KERNEL_LENGTH = 64
+
 
 def calc_score(p1: Photo, p2: Photo) -> int:
-    return min(p1 & p2, p1 - p2, p2 - p1)
+    overlap = p1 & p2
+    return min(overlap, len(p1) - overlap, len(p2) - overlap)
 
 
 @lru_cache(maxsize=2 ** 20)
@@ -28,7 +33,11 @@ def _apply(sequence: List[Photo], function: Callable[[Photo, Photo], int]) -> in
 
 
 def sequence_score(sequence: List[Photo]) -> int:
-    return _apply(sequence, calc_score)
+    if len(sequence) < MIN_KERNEL_LENGTH:
+        return _apply(sequence, calc_score)
+    bits, sizes = _pack(sequence)
+    order = np.arange(len(sequence))
+    return int(kernels.edge_scores(bits, sizes, order).sum())
 
 
 def sequence_max_score(sequence: List[Photo]) -> int:
@@ -39,38 +48,85 @@ def sequence_lost_score(sequence: List[Photo]) -> int:
     return _apply(sequence, calc_lost_score)
 
 
-def to_array(_x: Union[List[Photo], Photo], all_tags: list) -> np.array:
+COMPRESS_TAGS_FIRST = (
+    "Photos must have compressed tags, run compress_tags on the whole dataset first."
+)
+
+
+def nb_tags(data: List[Photo]) -> int:
+    """ Size of the tag id range of photos with compressed tags """
+    try:
+        return max((max(x.tags) + 1 for x in data if x.tags), default=0)
+    except TypeError:
+        raise ValueError(COMPRESS_TAGS_FIRST)
+
+
+def to_array(_x: Union[List[Photo], Photo], nb_tags: int) -> np.array:
     """
-    Convert a photo (or list of photos) to numpy array
-    all_tags -- list of all unique tags that we can meet
+    Convert a photo (or list of photos) with compressed tags to numpy array
+    nb_tags -- size of the tag id range
     """
-    if isinstance(_x, Photo):
-        tags = _x.tags
-        array = np.zeros(len(all_tags), dtype=np.bool)
-        for j, t in enumerate(all_tags):
-            if t in tags:
-                array[j] = True
-    else:
-        array = np.zeros((len(_x), len(all_tags)), dtype=np.bool)
-        for i, photo in enumerate(_x):
-            tags = photo.tags
-            for j, t in enumerate(all_tags):
-                if t in tags:
-                    array[i, j] = True
+    try:
+        if isinstance(_x, Photo):
+            array = np.zeros(nb_tags, dtype=np.bool_)
+            array[list(_x.tags)] = True
+        else:
+            array = np.zeros((len(_x), nb_tags), dtype=np.bool_)
+            for i, photo in enumerate(_x):
+                array[i, list(photo.tags)] = True
+    except IndexError:
+        raise ValueError(COMPRESS_TAGS_FIRST)
     return array
 
 
-def array_score(v: np.array, ar: np.array) -> np.array:
+def _pack(sequence: List[Photo]):
+    """
+    Packed bitsets and sizes of photos with any kind of tags,
+    tags are numbered in order of appearance
+    """
+    tag_ids = {}
+    columns = [tag_ids.setdefault(t, len(tag_ids)) for x in sequence for t in x.tags]
+    counts = [len(x.tags) for x in sequence]
+    nb_words = max((len(tag_ids) + 63) // 64, 1)
+    array = np.zeros((len(sequence), nb_words * 64), dtype=np.bool_)
+    array[np.repeat(np.arange(len(sequence)), counts), columns] = True
+    bits = np.packbits(array, axis=-1).view(np.uint64)
+    sizes = np.array([len(x) for x in sequence], dtype=np.int64)
+    return bits, sizes
+
+
+def to_bits(_x: Union[List[Photo], Photo], nb_tags: int) -> np.array:
+    """
+    Convert a photo (or list of photos) with compressed tags
+    to packed bitset (rows of uint64 words)
+    nb_tags -- size of the tag id range
+    """
+    nb_words = max((nb_tags + 63) // 64, 1)
+    array = to_array(_x, nb_words * 64)
+    return np.packbits(array, axis=-1).view(np.uint64)
+
+
+def bits_score(v: np.array, v_size: int, ar: np.array, ar_sizes: np.array) -> np.array:
+    """
+    Calculate score between packed photo bitset (v) and packed photo bitsets (ar)
+    v_size, ar_sizes -- number of tags (including private ones) in v and in ar
+    """
+    overlap = kernels.overlaps(v, ar)
+    return np.minimum.reduce([overlap, v_size - overlap, ar_sizes - overlap])
+
+
+def popcount(x: int) -> int:
+    return bin(x).count("1")
+
+
+def to_int_bits(photos: List[Photo]) -> List[int]:
     """
-    Calculate score between photo vector (v) and photo array (ar)
+    Convert photos with compressed tags to bitsets stored in python ints
     """
-    return np.minimum.reduce(
-        [
-            np.sum(np.logical_and(v, ar), axis=1),
-            np.sum(np.logical_and(v, np.logical_not(ar)), axis=1),
-            np.sum(np.logical_and(np.logical_not(v), ar), axis=1),
-        ]
-    )
+    try:
+        return [sum(1 << t for t in photo.tags) for photo in photos]
+    except TypeError:
+        raise ValueError(COMPRESS_TAGS_FIRST)
 
 
 def read_file(path: str) -> List[Photo]:
@@ -0,0 +1,20 @@
+import asyncio
+import argparse
+from slideshow_optimization.server import SOCKET, JobServer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=SOCKET, help="path to unix socket")
+    parser.add_argument("--port", type=int, help="listen on localhost:port instead")
+    parser.add_argument("--workers", type=int, default=2, help="number of workers")
+    parser.add_argument(
+        "--time-limit", type=float, default=600, help="default time budget of a job"
+    )
+    flags = parser.parse_args()
+    print(flags)
+
+    server = JobServer(nb_workers=flags.workers, time_limit=flags.time_limit)
+    try:
+        asyncio.run(server.serve(flags.socket, flags.port))
+    except KeyboardInterrupt:
+        pass
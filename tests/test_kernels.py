@@ -0,0 +1,93 @@
+import random
+import numpy as np
+import pytest
+from slideshow_optimization import kernels, utils
+from slideshow_optimization.models import Photo, Orientation
+
+requires_numba = pytest.mark.skipif(
+    kernels.numba is None, reason="numba is not installed"
+)
+
+
+def random_bits(nb_photos, nb_words, density=0.1, seed=0):
+    rnd = np.random.RandomState(seed)
+    array = rnd.random_sample((nb_photos, nb_words * 64)) < density
+    bits = np.packbits(array, axis=-1).view(np.uint64)
+    sizes = array.sum(axis=1).astype(np.int64)
+    return bits, sizes
+
+
+def assert_same(x, y):
+    assert x.dtype == y.dtype
+    np.testing.assert_array_equal(x, y)
+
+
+@pytest.mark.parametrize("nb_words", [1, 3])
+def test_overlaps_numpy(nb_words):
+    bits, _ = random_bits(50, nb_words, density=0.3)
+    expected = [
+        sum(bin(int(a & b)).count("1") for a, b in zip(bits[0], row)) for row in bits
+    ]
+    np.testing.assert_array_equal(kernels.overlaps_numpy(bits[0], bits), expected)
+
+
+@requires_numba
+@pytest.mark.parametrize("nb_words", [1, 2, 5])
+def test_overlaps(nb_words):
+    bits, _ = random_bits(100, nb_words)
+    for v in bits[:10]:
+        assert_same(kernels.overlaps_numpy(v, bits), kernels.overlaps_numba(v, bits))
+
+
+@requires_numba
+@pytest.mark.parametrize("nb_words", [1, 2, 5])
+def test_pair_scores(nb_words):
+    bits, sizes = random_bits(100, nb_words, density=0.3)
+    rnd = np.random.RandomState(1)
+    a, b = rnd.randint(100, size=500), rnd.randint(100, size=500)
+    assert_same(
+        kernels.pair_scores_numpy(bits, sizes, a, b),
+        kernels.pair_scores_numba(bits, sizes, a, b),
+    )
+
+
+@requires_numba
+@pytest.mark.parametrize("nb_words", [1, 2, 5])
+@pytest.mark.parametrize("n", [1, 2, 100])
+def test_edge_scores(nb_words, n):
+    bits, sizes = random_bits(100, nb_words, density=0.3)
+    order = np.random.RandomState(2).permutation(100)[:n]
+    assert_same(
+        kernels.edge_scores_numpy(bits, sizes, order),
+        kernels.edge_scores_numba(bits, sizes, order),
+    )
+
+
+@requires_numba
+@pytest.mark.parametrize("nb_words", [1, 2, 5])
+@pytest.mark.parametrize("i", [1, 2, 50, 98, 99])
+def test_two_opt_gains(nb_words, i):
+    bits, sizes = random_bits(100, nb_words, density=0.3)
+    order = np.random.RandomState(3).permutation(100)
+    gains_numpy, max_gains_numpy = kernels.two_opt_gains_numpy(bits, sizes, order, i)
+    gains_numba, max_gains_numba = kernels.two_opt_gains_numba(bits, sizes, order, i)
+    assert len(gains_numpy) == len(order) - i - 1
+    assert_same(gains_numpy, gains_numba)
+    assert_same(max_gains_numpy, max_gains_numba)
+
+
+def test_sequence_score():
+    rnd = random.Random(4)
+    tags = [f"t{x}" for x in range(150)]
+    photos = [
+        Photo(i, set(rnd.sample(tags, rnd.randint(1, 20))), Orientation.Horizontal)
+        for i in range(300)
+    ]
+    expected = sum(
+        min(len(a.tags & b.tags), len(a.tags - b.tags), len(b.tags - a.tags))
+        for a, b in zip(photos[:-1], photos[1:])
+    )
+    assert utils.sequence_score(photos) == expected
+    assert utils.sequence_score(photos[:10]) == utils._apply(
+        photos[:10], utils.calc_score
+    )